@@ -0,0 +1,66 @@
+"""Lookup tables for the LR35902 arithmetic and logic unit.
+
+Every entry packs the 8-bit result in the high byte and the resulting
+flags (Z N H C in bits 7-4) in the low byte, so an instruction gets both
+from a single index. The tables are built once at import and shared by
+every CPU instance."""
+
+from array import array
+
+
+def pack(result, z, n, h, c):
+    return (result & 0xFF) << 8 | z << 7 | n << 6 | h << 5 | c << 4
+
+
+def add(i):
+    c, a, b = i >> 16, i >> 8 & 0xFF, i & 0xFF
+    result = a + b + c
+    return pack(result, result & 0xFF == 0, 0, (a & 0xF) + (b & 0xF) + c > 0xF, result > 0xFF)
+
+
+def sub(i):
+    c, a, b = i >> 16, i >> 8 & 0xFF, i & 0xFF
+    result = a - b - c
+    return pack(result, result & 0xFF == 0, 1, (a & 0xF) < (b & 0xF) + c, result < 0)
+
+
+def daa(i):
+    n, h, c, a = i >> 10 & 0x1, i >> 9 & 0x1, i >> 8 & 0x1, i & 0xFF
+    if n:
+        if c:
+            a -= 0x60
+        if h:
+            a -= 0x06
+    else:
+        if c or a > 0x99:
+            a += 0x60
+            c = 1
+        if h or a & 0xF > 0x9:
+            a += 0x06
+    return pack(a, a & 0xFF == 0, n, 0, c)
+
+
+def shift(result, carry):
+    return pack(result, result & 0xFF == 0, 0, 0, carry)
+
+
+# Indexed by carry << 16 | a << 8 | b. ADD and SUB use the lower half.
+ADDTABLE = array("H", [add(i) for i in range(0x20000)])
+SUBTABLE = array("H", [sub(i) for i in range(0x20000)])
+
+# Indexed by the operand. The carry flag is left to the caller since INC and DEC preserve it.
+INCTABLE = array("H", [pack(v + 1, (v + 1) & 0xFF == 0, 0, v & 0xF == 0xF, 0) for v in range(0x100)])
+DECTABLE = array("H", [pack(v - 1, v == 1, 1, v & 0xF == 0, 0) for v in range(0x100)])
+
+# Indexed by N H C << 8 | A, which is (F & 0x70) << 4 | A.
+DAATABLE = array("H", [daa(i) for i in range(0x800)])
+
+# CB-prefixed rotates and shifts, indexed by carry << 8 | value.
+RLCTABLE = array("H", [shift(v << 1 | v >> 7, v >> 7) for v in range(0x100)] * 2)
+RRCTABLE = array("H", [shift(v >> 1 | v << 7, v & 0x1) for v in range(0x100)] * 2)
+RLTABLE = array("H", [shift(i << 1 | i >> 8, i >> 7 & 0x1) for i in range(0x200)])
+RRTABLE = array("H", [shift(i >> 1 | (i >> 8) << 7, i & 0x1) for i in range(0x200)])
+SLATABLE = array("H", [shift(v << 1, v >> 7) for v in range(0x100)] * 2)
+SRATABLE = array("H", [shift(v >> 1 | v & 0x80, v & 0x1) for v in range(0x100)] * 2)
+SWAPTABLE = array("H", [shift(v << 4 | v >> 4, 0) for v in range(0x100)] * 2)
+SRLTABLE = array("H", [shift(v >> 1, v & 0x1) for v in range(0x100)] * 2)
@@ -0,0 +1,145 @@
+import random
+import sys
+import time
+
+import bus
+import cpu
+from blocks import BlockCompiler
+from decodecache import DecodeCache
+from scheduler import Scheduler
+
+
+# Single-byte opcodes that only touch registers, so the stream can be
+# replayed without a program counter or memory layout behind it.
+REGISTER_OPCODES = [op for op in range(0x40, 0xC0) if op & 0x7 != 0x6 and op != 0x76]
+
+
+def opcodestream(count, seed = 0x5EED):
+    "Returns a reproducible sequence of register-only opcodes."
+    rng = random.Random(seed)
+    return [rng.choice(REGISTER_OPCODES) for i in range(count)]
+
+
+def decode(count = 200000, repeat = 5):
+    "Measures instructions per second through LR35902.readopcode."
+    stream = opcodestream(count)
+    best = 0
+    for i in range(repeat):
+        proc = cpu.LR35902(bus.Bus())
+        readopcode = proc.readopcode
+        start = time.perf_counter()
+        for byte in stream:
+            readopcode(byte)
+        elapsed = time.perf_counter() - start
+        best = max(best, count / elapsed)
+    return best
+
+
+# A tight loop at 0x0100 that stores, increments, does ALU work and jumps back.
+LOOP = bytes([
+    0x06, 0x10,             # LD B, 0x10
+    0x21, 0x00, 0xC0,       # LD HL, 0xC000
+    0x77,                   # LD (HL), A     <- 0x0105
+    0x23,                   # INC HL
+    0x80,                   # ADD A, B
+    0x0D,                   # DEC C
+    0xAA,                   # XOR D
+    0x5F,                   # LD E, A
+    0xFE, 0x42,             # CP 0x42
+    0xC3, 0x05, 0x01        # JP 0x0105
+])
+
+
+def loadprogram(program, addr = 0x0100):
+    "Returns a CPU with program written to RAM at addr and PC pointing at it."
+    proc = cpu.LR35902(bus.Bus())
+    for i, byte in enumerate(program):
+        proc.bus.write(addr + i, byte)
+    proc.PC = addr
+    return proc
+
+
+# Ways of running the CPU: plain opcode dispatch, the pre-decoded instruction cache and compiled blocks.
+ENGINES = {"plain" : None, "decoded" : DecodeCache, "blocks" : BlockCompiler}
+
+
+def run(cycles = 4194304, repeat = 3, engine = "plain"):
+    "Measures emulated clock cycles per second through the run_cycles of engine."
+    best = 0
+    for i in range(repeat):
+        proc = loadprogram(LOOP)
+        runner = proc if ENGINES[engine] is None else ENGINES[engine](proc)
+        start = time.perf_counter()
+        runner.run_cycles(cycles)
+        elapsed = time.perf_counter() - start
+        best = max(best, proc.cycles / elapsed)
+    return best
+
+
+# Periods in clock cycles of peripherals similar to the timer, a scanline and a frame.
+PERIODS = (1024, 456, 70224)
+
+
+class Ticked():
+    "Peripheral that counts down on every instruction."
+
+    def __init__(self, period):
+        self.period = period
+        self.counter = period
+        self.fired = 0
+
+    def tick(self, cycles):
+        self.counter -= cycles
+        if self.counter <= 0:
+            self.counter += self.period
+            self.fired += 1
+
+
+class Scheduled():
+    "Peripheral that reschedules itself on the event scheduler."
+
+    def __init__(self, scheduler, period):
+        self.scheduler = scheduler
+        self.period = period
+        self.fired = 0
+        scheduler.schedule(period, self.fire)
+
+    def fire(self, cycle):
+        self.fired += 1
+        self.scheduler.schedule(cycle + self.period, self.fire)
+
+
+def scheduling(count = 1000000, seed = 0x5EED):
+    "Compares per-instruction ticking with the event scheduler over a stream of instruction costs. Returns seconds for each."
+    rng = random.Random(seed)
+    costs = [rng.choice((4, 4, 4, 8, 8, 12, 16)) for i in range(count)]
+
+    peripherals = [Ticked(period) for period in PERIODS]
+    start = time.perf_counter()
+    for cycles in costs:
+        for peripheral in peripherals:
+            peripheral.tick(cycles)
+    ticked = time.perf_counter() - start
+
+    scheduler = Scheduler()
+    events = [Scheduled(scheduler, period) for period in PERIODS]
+    now = 0
+    start = time.perf_counter()
+    for cycles in costs:
+        now += cycles
+        if now >= scheduler.next:
+            scheduler.run(now)
+    scheduled = time.perf_counter() - start
+
+    assert [p.fired for p in peripherals] == [e.fired for e in events]
+    return ticked, scheduled
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print(f"decode: {decode(count):,.0f} instructions/s")
+    for engine in ENGINES:
+        speed = run(engine = engine)
+        print(f"run {engine}: {speed:,.0f} cycles/s ({speed / 4194304:.2f}x real time)")
+    ticked, scheduled = scheduling()
+    print(f"peripherals: ticked {ticked:.3f}s, scheduled {scheduled:.3f}s per 1M instructions")
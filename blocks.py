@@ -0,0 +1,553 @@
+"""Basic-block compiler for the LR35902.
+
+A block is the straight-line run of instructions starting at a PC, up to and
+including the first jump, call or return. It is translated into the source of
+a single Python function that keeps the registers in locals, computes F only
+where a later instruction or the block exit reads it, and is compiled once and
+cached. Blocks never cross a 256-byte page and are keyed by the page view they
+were decoded from and their PC; the MBCs keep one view per bank page, so the
+view identifies the bank."""
+
+import re
+
+from alu import (ADDTABLE, SUBTABLE, INCTABLE, DECTABLE, DAATABLE, RLCTABLE, RRCTABLE,
+                 RLTABLE, RRTABLE, SLATABLE, SRATABLE, SWAPTABLE, SRLTABLE)
+from cpu import HANDLERS, PREFIXEDHANDLERS, LENGTHS
+
+
+MAXLENGTH = 32 # Instructions per block
+
+R8 = ["B", "C", "D", "E", "H", "L", "(HL)", "A"]
+R16 = ["BC", "DE", "HL", "SP"]
+STACK16 = ["BC", "DE", "HL", "AF"]
+CONDITIONS = ["not F & 0x80", "F & 0x80", "not F & 0x10", "F & 0x10"]
+ALU = ["ADD", "ADC", "SUB", "SBC", "AND", "XOR", "OR", "CP"]
+SHIFTS = [("RLC", False), ("RRC", False), ("RL", True), ("RR", True),
+          ("SLA", False), ("SRA", False), ("SWAP", False), ("SRL", False)]
+
+REGISTERS = ("A", "F", "B", "C", "D", "E", "H", "L", "SP")
+ASSIGNED = re.compile(r"^\s*(A|F|B|C|D|E|H|L|SP) = ", re.MULTILINE)
+NAMESPACE = {name : table for name, table in (
+    ("ADDTABLE", ADDTABLE), ("SUBTABLE", SUBTABLE), ("INCTABLE", INCTABLE), ("DECTABLE", DECTABLE),
+    ("DAATABLE", DAATABLE), ("RLCTABLE", RLCTABLE), ("RRCTABLE", RRCTABLE), ("RLTABLE", RLTABLE),
+    ("RRTABLE", RRTABLE), ("SLATABLE", SLATABLE), ("SRATABLE", SRATABLE), ("SWAPTABLE", SWAPTABLE),
+    ("SRLTABLE", SRLTABLE))}
+
+
+def read8(r):
+    "Returns the source that reads the 8-bit operand r from the register locals."
+    return "read(H << 8 | L)" if r == "(HL)" else r
+
+
+def write8(r, value):
+    "Returns the source that writes value to the 8-bit operand r."
+    return f"write(H << 8 | L, {value})" if r == "(HL)" else f"{r} = {value}"
+
+
+def pair(rr):
+    "Returns the source that reads the 16-bit register rr."
+    return rr if rr == "SP" else f"({rr[0]} << 8 | {rr[1]})"
+
+
+def setpair(rr, value):
+    "Returns the source lines that write value to the 16-bit register rr."
+    if rr == "SP":
+        return [f"SP = {value}"]
+    return [f"w = {value}", f"{rr[0]} = w >> 8", f"{rr[1]} = w & 0xFF"]
+
+
+def signed(u8):
+    return u8 - 0x100 if u8 & 0x80 else u8
+
+
+def alu(op, x):
+    "Returns (lines, flags, partial, uses) for the arithmetic or logic operation op with operand source x."
+    if op in ("AND", "XOR", "OR"):
+        symbol = {"AND" : "&", "XOR" : "^", "OR" : "|"}[op]
+        flags = "F = 0x20 if A else 0xA0" if op == "AND" else "F = 0x00 if A else 0x80"
+        return [f"A = A {symbol} {x}"], flags, False, False
+    table = "ADDTABLE" if op in ("ADD", "ADC") else "SUBTABLE"
+    carry = "(F & 0x10) << 12 | " if op in ("ADC", "SBC") else ""
+    lines = [f"v = {table}[{carry}A << 8 | {x}]"]
+    if op != "CP":
+        lines.append("A = v >> 8")
+    return lines, "F = v & 0xFF", False, bool(carry)
+
+
+def instruction(op, operand):
+    """Translates a non-branching opcode. Returns (lines, flags, partial, uses), where flags is the
+    line that writes F, partial whether that line keeps some of the old flags and uses whether the
+    other lines read F, or None if the opcode ends a block."""
+    if 0x40 <= op < 0x80 and op != 0x76:
+        dst, src = R8[op >> 3 & 0x7], R8[op & 0x7]
+        return [write8(dst, read8(src))], None, False, False
+
+    if 0x80 <= op < 0xC0 or op & 0xC7 == 0xC6:
+        x = read8(R8[op & 0x7]) if op < 0xC0 else f"{operand:#04x}"
+        return alu(ALU[op >> 3 & 0x7], x)
+
+    if op < 0x40:
+        r, rr = R8[op >> 3 & 0x7], R16[op >> 4 & 0x3]
+        low = op & 0x7
+        if op & 0xF == 0x1:
+            return setpair(rr, f"{operand:#06x}"), None, False, False
+        if op & 0xF == 0x3:
+            return setpair(rr, f"{pair(rr)} + 1 & 0xFFFF"), None, False, False
+        if op & 0xF == 0xB:
+            return setpair(rr, f"{pair(rr)} - 1 & 0xFFFF"), None, False, False
+        if op & 0xF == 0x9:
+            lines = ["hl = H << 8 | L", f"n = {pair(rr)}", "w = hl + n", "H = w >> 8 & 0xFF", "L = w & 0xFF"]
+            return lines, "F = F & 0x80 | ((hl & 0xFFF) + (n & 0xFFF) > 0xFFF) << 5 | (w > 0xFFFF) << 4", True, False
+        if low == 0x4 or low == 0x5:
+            table = "INCTABLE" if low == 0x4 else "DECTABLE"
+            lines = [f"v = {table}[{read8(r)}]", write8(r, "v >> 8")]
+            return lines, "F = F & 0x10 | v & 0xFF", True, False
+        if low == 0x6:
+            return [write8(r, f"{operand:#04x}")], None, False, False
+        if op == 0x00:
+            return [], None, False, False
+        if op in (0x02, 0x12):
+            return [f"write({pair(R16[op >> 4])}, A)"], None, False, False
+        if op in (0x0A, 0x1A):
+            return [f"A = read({pair(R16[op >> 4])})"], None, False, False
+        if op in (0x22, 0x2A, 0x32, 0x3A):
+            access = "write(hl, A)" if op & 0x8 == 0 else "A = read(hl)"
+            step = "+ 1" if op < 0x30 else "- 1"
+            return ["hl = H << 8 | L", access] + setpair("HL", f"hl {step} & 0xFFFF"), None, False, False
+        if op == 0x08:
+            return [f"write({operand:#06x}, SP & 0xFF)", f"write({operand + 1 & 0xFFFF:#06x}, SP >> 8)"], None, False, False
+        if op in (0x07, 0x0F, 0x17, 0x1F):
+            table, uses = {0x07 : ("RLCTABLE", False), 0x0F : ("RRCTABLE", False),
+                           0x17 : ("RLTABLE", True), 0x1F : ("RRTABLE", True)}[op]
+            return [f"v = {table}[(F & 0x10) << 4 | A]" if uses else f"v = {table}[A]", "A = v >> 8"], "F = v & 0x10", False, uses
+        if op == 0x27:
+            return ["v = DAATABLE[(F & 0x70) << 4 | A]", "A = v >> 8"], "F = v & 0xFF", False, True
+        if op == 0x2F:
+            return ["A = A ^ 0xFF"], "F = F | 0x60", True, False
+        if op == 0x37:
+            return [], "F = F & 0x80 | 0x10", True, False
+        if op == 0x3F:
+            return [], "F = (F & 0x90) ^ 0x10", True, False
+        return None
+
+    if op & 0xCF == 0xC1:
+        rr = STACK16[op >> 4 & 0x3]
+        lines = ["lo = read(SP)", "hi = read(SP + 1 & 0xFFFF)", "SP = SP + 2 & 0xFFFF", f"{rr[0]} = hi"]
+        if rr == "AF":
+            return lines, "F = lo & 0xF0", False, False
+        return lines + [f"{rr[1]} = lo"], None, False, False
+    if op & 0xCF == 0xC5:
+        rr = STACK16[op >> 4 & 0x3]
+        lines = ["SP = SP - 2 & 0xFFFF", f"write(SP + 1 & 0xFFFF, {rr[0]})", f"write(SP, {rr[1]})"]
+        return lines, None, False, rr == "AF"
+
+    if op == 0xCB:
+        return prefixed(operand)
+    if op in (0xE0, 0xF0):
+        access = f"write({0xFF00 | operand:#06x}, A)" if op == 0xE0 else f"A = read({0xFF00 | operand:#06x})"
+        return [access], None, False, False
+    if op in (0xE2, 0xF2):
+        return ["write(0xFF00 | C, A)" if op == 0xE2 else "A = read(0xFF00 | C)"], None, False, False
+    if op in (0xEA, 0xFA):
+        access = f"write({operand:#06x}, A)" if op == 0xEA else f"A = read({operand:#06x})"
+        return [access], None, False, False
+    if op in (0xE8, 0xF8):
+        s8 = signed(operand)
+        lines = ["n = SP", f"w = n + {s8} & 0xFFFF"] + (["SP = w"] if op == 0xE8 else ["H = w >> 8", "L = w & 0xFF"])
+        return lines, f"F = ((n ^ {s8} ^ w) & 0x10) << 1 | ((n ^ {s8} ^ w) & 0x100) >> 4", False, False
+    if op == 0xF9:
+        return ["SP = H << 8 | L"], None, False, False
+    return None
+
+
+def prefixed(op):
+    "Translates a CB-prefixed opcode. Returns the same tuple as instruction."
+    r = R8[op & 0x7]
+    x = read8(r)
+    b = op >> 3 & 0x7
+    if op < 0x40:
+        name, uses = SHIFTS[b]
+        index = f"(F & 0x10) << 4 | {x}" if uses else x
+        return [f"v = {name}TABLE[{index}]", write8(r, "v >> 8")], "F = v & 0xFF", False, uses
+    if op < 0x80:
+        return [], f"F = F & 0x10 | (0x20 if {x} >> {b} & 0x1 else 0xA0)", True, False
+    if op < 0xC0:
+        return [write8(r, f"{x} & {~(1 << b) & 0xFF:#04x}")], None, False, False
+    return [write8(r, f"{x} | {1 << b:#04x}")], None, False, False
+
+
+def terminator(op, operand, next):
+    """Translates a jump, call or return. Returns (lines, uses) where lines set the local PC, add the
+    cycles of a taken branch and pick the exit link, or None if op does not end a block. Exits to a
+    fixed address use link0, or link1 for a branch not taken; computed ones go through DISPATCH."""
+    call = ["SP = SP - 2 & 0xFFFF", f"write(SP + 1 & 0xFFFF, {next >> 8:#04x})", f"write(SP, {next & 0xFF:#04x})"]
+    ret = ["PC = read(SP) | read(SP + 1 & 0xFFFF) << 8", "SP = SP + 2 & 0xFFFF", "link = DISPATCH"]
+    if op == 0xC3:
+        return [f"PC = {operand:#06x}", "cycles += 4", "link = link0"], False
+    if op == 0x18:
+        return [f"PC = {next + signed(operand) & 0xFFFF:#06x}", "cycles += 4", "link = link0"], False
+    if op == 0xCD:
+        return call + [f"PC = {operand:#06x}", "cycles += 12", "link = link0"], False
+    if op == 0xC9:
+        return ret + ["cycles += 12"], False
+    if op == 0xE9:
+        return ["PC = H << 8 | L", "link = DISPATCH"], False
+    if op & 0xC7 == 0xC7:
+        return call + [f"PC = {op & 0x38:#04x}", "link = link0"], False
+
+    if op & 0xE7 == 0x20:
+        taken = [f"PC = {next + signed(operand) & 0xFFFF:#06x}", "cycles += 4", "link = link0"]
+    elif op & 0xE7 == 0xC2:
+        taken = [f"PC = {operand:#06x}", "cycles += 4", "link = link0"]
+    elif op & 0xE7 == 0xC4:
+        taken = call + [f"PC = {operand:#06x}", "cycles += 12", "link = link0"]
+    elif op & 0xE7 == 0xC0:
+        taken = ret + ["cycles += 12"]
+    else:
+        return None
+    lines = [f"if {CONDITIONS[op >> 3 & 0x3]}:"] + ["    " + line for line in taken]
+    return lines + ["else:", f"    PC = {next:#06x}", "    link = link1"], True
+
+
+def target(op, operand, next):
+    "Returns the fixed destination of a JP or JR, or None for other opcodes."
+    if op == 0x18 or op & 0xE7 == 0x20:
+        return next + signed(operand) & 0xFFFF
+    if op == 0xC3 or op & 0xE7 == 0xC2:
+        return operand
+    return None
+
+
+ACCESS = re.compile(r"\b(?:read|write)\(((?:[^(),]|\([^()]*\))*)")
+
+
+def clocked(lines):
+    """Returns whether lines access an address that may be an I/O register. Registers derived from the clock
+    read cpu.cycles, so it is brought up to date before such accesses; constant addresses below 0xFF00 are not."""
+    for expr in ACCESS.findall("\n".join(lines)):
+        if not re.fullmatch("0x[0-9a-f]+", expr) or int(expr, 16) >= 0xFF00:
+            return True
+    return False
+
+
+READ = re.compile(r"read\(((?:[^()]|\([^()]*\))*)\)")
+POINTERS = {"H << 8 | L" : "HL", "(B << 8 | C)" : "BC", "(D << 8 | E)" : "DE", "0xFF00 | C" : "C"}
+
+
+def polls(lines):
+    """Returns the addresses the body of an idle loop candidate reads, as constants or the names of the
+    registers holding them, or None if the body writes memory or reads an address it computes itself."""
+    source = "\n".join(lines)
+    if "write(" in source:
+        return None
+    assigned = set(ASSIGNED.findall(source))
+    reads = []
+    for expr in READ.findall(source):
+        if expr in POINTERS:
+            if assigned & set(POINTERS[expr]):
+                return None
+            reads.append(POINTERS[expr])
+        elif re.fullmatch("0x[0-9a-f]+", expr):
+            reads.append(int(expr, 16))
+        else:
+            return None
+    return tuple(reads)
+
+
+DISPATCH = [None] # Exit link that is never patched, for jumps whose target is only known at run time
+
+
+class BlockCompiler():
+    """Runs a CPU through compiled blocks instead of the per-opcode handlers.
+    Writable pages that hold compiled code are watched on the bus, and a write
+    invalidates the blocks it lands in. With skipidle, loops that poll memory
+    without changing anything are fast-forwarded to the next point where what they
+    read can change."""
+
+    def __init__(self, cpu, skipidle = True):
+        self.cpu = cpu
+        self.bus = cpu.bus
+        self.blocks = {} # (id(page view), PC) : function, or None if PC starts with an opcode blocks leave to the interpreter
+        self.incoming = {} # block key : {id(link) : link} of the exits patched to jump to it
+        self.outgoing = {} # block key : exit links of the block
+        self.farlinks = [] # Links to another page, which a bank switch can remap
+        self.pageblocks = {} # id(page view) : (page view, [(start, end, key), ...])
+        self.compiled = 0
+        self.hits = 0
+        self.invalidations = 0
+        self.links = 0
+        self.skipidle = skipidle
+        self.skipped = 0 # Clock cycles fast-forwarded in idle loops
+        self.spinstate = None # CPU state and clock at the end of the last idle loop candidate iteration
+        self.target = 0 # Clock cycle the current run_cycles call stops at
+        self.generation = 0 # Bumped whenever a write may have changed code, checked by blocks after their writes
+
+        # Writes to the cartridge switch banks, so they go through writerom to be noticed by the running block.
+        self.romwriters = {}
+        for page in range(0x80):
+            if self.bus.writebuffers[page] is None:
+                self.romwriters[page] = self.bus.writehandlers[page]
+                self.bus.writehandlers[page] = self.writerom
+
+        # Writes to IE and IF can raise an interrupt, which is taken before the next instruction runs.
+        self.irqwriters = {}
+        for reg in (0x0F, 0xFF):
+            self.irqwriters[reg] = self.bus.iowriters[reg]
+            self.bus.iowriters[reg] = self.writeirq
+
+    def stats(self):
+        "Returns the number of blocks compiled, cache hits, invalidated blocks, exits linked to their successor and cycles skipped in idle loops."
+        return {"compiled" : self.compiled, "hits" : self.hits, "invalidations" : self.invalidations,
+                "links" : self.links, "skipped" : self.skipped}
+
+    def decode(self, PC):
+        """Returns the source lines of the block at PC, its clock cycles, the address past its end and, for a block
+        that loops back to itself without writing memory, the addresses it polls. None if the first instruction cannot be compiled."""
+        page = self.bus.readbuffers[PC >> 8]
+        offset = PC & 0xFF
+        addr = PC
+        body = []
+        live = [] # (lines, flags, partial, uses, exit) in block order
+        elapsed = 0
+        ending = None
+        count = 0
+        while count < MAXLENGTH and offset < 0x100:
+            op = page[offset]
+            length = LENGTHS[op]
+            if offset + length > 0x100:
+                break
+            operand = page[offset + 1] if length == 2 else page[offset + 1] | page[offset + 2] << 8 if length == 3 else None
+            next = addr + length & 0xFFFF
+            cycles = PREFIXEDHANDLERS[operand][1] if op == 0xCB else HANDLERS[op][1]
+            ending = terminator(op, operand, next)
+            if ending is not None:
+                jump = target(op, operand, next)
+                if clocked(ending[0]):
+                    ending = ([f"cpu.cycles = cycles + {elapsed}"] + ending[0], ending[1])
+                elapsed += cycles
+                addr = next
+                break
+            translated = instruction(op, operand)
+            if translated is None:
+                break
+            lines, flags, partial, uses = translated
+            if clocked(lines):
+                lines = [f"cpu.cycles = cycles + {elapsed}"] + lines
+            elapsed += cycles
+            offset += length
+            addr = next
+            # A write can change the code of this very block or switch its bank, so leave if it did.
+            exit = f"EXIT {addr} {elapsed}" if any("write(" in line for line in lines) else None
+            live.append((lines, flags, partial, uses, exit))
+            count += 1
+        if not live and ending is None:
+            return None
+
+        # Walk backwards dropping writes to F that are overwritten before anything reads them.
+        needed = True # F is stored on exit
+        for lines, flags, partial, uses, exit in reversed(live):
+            if exit is not None:
+                needed = True
+            if flags is not None and not needed:
+                flags = None
+            body.append(lines + ([flags] if flags is not None else []) + ([exit] if exit is not None else []))
+            if flags is not None:
+                needed = uses or partial
+            else:
+                needed = uses or needed
+        body.reverse()
+        lines = [line for instr in body for line in instr]
+        lines += ending[0] if ending is not None else [f"PC = {addr:#06x}", "link = link0"]
+        reads = polls(lines) if ending is not None and jump == PC else None
+        return lines, elapsed, addr, reads
+
+    def compile(self, PC):
+        "Compiles the block at PC, caches it and returns the function, or None if it cannot be compiled."
+        page = self.bus.readbuffers[PC >> 8]
+        key = (id(page), PC)
+        decoded = self.decode(PC)
+        if decoded is None:
+            self.blocks[key] = None
+            return None
+        lines, elapsed, end, reads = decoded
+        source = "\n".join(lines)
+        used = [r for r in REGISTERS if re.search(rf"\b{r}\b", source)]
+        assigned = sorted(set(ASSIGNED.findall(source)), key = REGISTERS.index)
+        head = [f"{r} = cpu.{r}" for r in used]
+        if "read(" in source:
+            head.append("read = cpu.bus.read")
+        if "write(" in source:
+            head.append("write = cpu.bus.write")
+        head.append("cycles = cpu.cycles")
+        if "EXIT " in source:
+            head.append("generation = compiler.generation")
+        stores = [f"cpu.{r} = {r}" for r in assigned]
+        tail = stores + ["cpu.PC = PC", f"cpu.cycles = cycles + {elapsed}"]
+        if reads is not None:
+            # Taken jumps to the block itself add 4 cycles on top of the block.
+            tail += [f"if PC == {PC:#06x}:", f"    return compiler.spin({elapsed + 4}, {reads!r}, link)"]
+        tail.append("return link")
+        body = []
+        for line in lines:
+            if line.startswith("EXIT "):
+                addr, cycles = line.split()[1:]
+                body.append("if compiler.generation != generation:")
+                body.extend("    " + store for store in stores + [f"cpu.PC = {int(addr):#06x}", f"cpu.cycles = cycles + {cycles}", "return DISPATCH"])
+            else:
+                body.append(line)
+        name = f"block_{PC:04X}"
+        body = "".join(f"    {line}\n" for line in head + body + tail)
+        # An exit link holds the successor function once it is patched, the page of this block and the successor's key.
+        links = [[None, PC >> 8, None], [None, PC >> 8, None]]
+        namespace = dict(NAMESPACE, compiler = self, DISPATCH = DISPATCH, link0 = links[0], link1 = links[1])
+        exec(compile(f"def {name}(cpu):\n{body}", f"<{name}>", "exec"), namespace)
+        function = namespace[name]
+
+        self.blocks[key] = function
+        self.outgoing[key] = links
+        self.pageblocks.setdefault(id(page), (page, []))[1].append((PC, end, key))
+        self.bus.watch(PC >> 8, self.written)
+        self.compiled += 1
+        return function
+
+    def written(self, addr):
+        "Invalidates the blocks covering addr after a write to a watched page."
+        self.invalidate(self.bus.readbuffers[addr >> 8], addr)
+
+    def writerom(self, addr, data):
+        "Passes a write to the memory bank controller."
+        self.generation += 1
+        self.romwriters[addr >> 8](addr, data)
+        for link in self.farlinks:
+            self.unlink(link)
+        self.farlinks.clear()
+
+    def writeirq(self, addr, data):
+        "Passes a write to IE or IF to the CPU and leaves the running block if it raised an interrupt."
+        self.irqwriters[addr & 0xFF](addr, data)
+        if self.cpu.irqevent is not None:
+            self.generation += 1
+
+    def unlink(self, link):
+        "Points an exit link back at the dispatcher."
+        if link[2] is not None:
+            self.incoming.get(link[2], {}).pop(id(link), None)
+        link[0] = link[2] = None
+
+    def invalidate(self, view, addr = None):
+        "Drops the blocks decoded from view that cover addr, or all of them if addr is None."
+        entry = self.pageblocks.get(id(view))
+        if entry is None:
+            return
+        kept = []
+        for start, end, key in entry[1]:
+            if addr is None or start <= addr < end:
+                del self.blocks[key]
+                for link in self.incoming.pop(key, {}).values():
+                    link[0] = link[2] = None
+                for link in self.outgoing.pop(key, ()):
+                    self.unlink(link)
+                self.invalidations += 1
+                self.generation += 1
+            else:
+                kept.append((start, end, key))
+        if kept:
+            entry[1][:] = kept
+        else:
+            del self.pageblocks[id(view)]
+
+    def lookup(self, PC):
+        "Returns the key and function of the block at PC, compiling it on a miss. The function is None where the interpreter has to step."
+        page = self.bus.readbuffers[PC >> 8]
+        if page is None:
+            return None, None # Code on a handler mapped page, such as HRAM, is interpreted.
+        key = (id(page), PC)
+        block = self.blocks.get(key)
+        if block is not None:
+            if self.bus.writebuffers[PC >> 8] is not None:
+                # The page was remapped since the block was compiled, so writes may have been missed.
+                self.invalidate(page)
+                block = self.compile(PC)
+            else:
+                self.hits += 1
+        elif key not in self.blocks:
+            block = self.compile(PC)
+        return key, block
+
+    def link(self, link, PC):
+        "Returns the block at PC and patches it into the exit link that led there."
+        key, block = self.lookup(PC)
+        if block is not None:
+            link[0] = block
+            link[2] = key
+            self.incoming.setdefault(key, {})[id(link)] = link
+            if PC >> 8 != link[1]:
+                self.farlinks.append(link)
+            self.links += 1
+        return block
+
+    def spin(self, period, reads, link):
+        """Called when an idle loop candidate jumps back to itself, period cycles after it last did. Once an iteration
+        leaves the CPU state unchanged, skips the iterations that would repeat it before the scheduler, the end of
+        run_cycles or a change in a polled I/O register could make a difference."""
+        cpu = self.cpu
+        now = cpu.cycles
+        state = (cpu.A, cpu.F, cpu.B, cpu.C, cpu.D, cpu.E, cpu.H, cpu.L, cpu.SP, cpu.PC, now)
+        last = self.spinstate
+        self.spinstate = state
+        if not self.skipidle or last is None or last[:-1] != state[:-1] or last[-1] != now - period:
+            return link
+
+        bus = self.bus
+        limit = min(cpu.scheduler.next, self.target) - 1
+        for addr in reads:
+            if type(addr) != int:
+                addr = getattr(cpu, addr) | 0xFF00 if addr == "C" else getattr(cpu, addr)
+            if addr >> 8 == 0xFF:
+                if bus.ioreaders[addr & 0xFF] is None:
+                    continue
+                changes = bus.iochanges[addr & 0xFF]
+                if changes is None:
+                    return link # The register is computed on read and gives no hint when it changes.
+                change = changes(now - period)
+                if change <= now:
+                    return link # It changed during the iteration that was just compared.
+                limit = min(limit, change)
+            elif bus.readbuffers[addr >> 8] is None:
+                return link # Handler mapped memory, such as a real time clock, may change at any time.
+
+        skipped = (limit - now) // period * period
+        if skipped > 0:
+            cpu.cycles = now + skipped
+            self.skipped += skipped
+            self.spinstate = state[:-1] + (now + skipped,)
+        return link
+
+    def run_cycles(self, n):
+        "Executes compiled blocks until at least n clock cycles have passed and returns the cycles executed."
+        cpu = self.cpu
+        start = cpu.cycles
+        target = start + n
+        self.target = target
+        scheduler = cpu.scheduler
+        block = None
+        while cpu.cycles < target:
+            if block is None:
+                if cpu.halted:
+                    cpu.skiphalt(target)
+                    continue
+                if cpu.eievent is not None:
+                    cpu.step() # IME is set after the instruction following EI, not after a whole block.
+                    continue
+                block = self.lookup(cpu.PC)[1]
+                if block is None:
+                    cpu.step()
+                    continue
+            link = block(cpu)
+            block = link[0]
+            if block is None and link is not DISPATCH:
+                block = self.link(link, cpu.PC)
+            if cpu.cycles >= scheduler.next:
+                scheduler.run(cpu.cycles)
+                block = None # Events can change what runs next.
+        return cpu.cycles - start
@@ -3,24 +3,148 @@ import cpu
 
 
 class Bus():
-    
-    def __init__(self, ram = [0x0]*0x10000):
-        self.ram = ram
-    
-    def write(self, addr, data):
-        "Writes to address in RAM."
-        if addr <= 0xFFFF:
-            self.ram[addr] = data
 
-    def read(self, addr) -> int:
-        "Returns value at address in RAM."
-        if addr <= 0xFFFF:
+    def __init__(self, cartridge = None):
+        "Allocates the address space and maps the cartridge ROM into it."
+        self.ram = bytearray(0x10000)
+        self.memory = memoryview(self.ram)
+
+        # Zero-copy views over the regions of the address space that other parts map or read directly.
+        self.vram = self.memory[0x8000:0xA000]
+        self.wram = self.memory[0xC000:0xE000]
+        self.oam = self.memory[0xFE00:0xFEA0]
+
+        # One entry per 256-byte page. A page is either backed by a buffer
+        # that is indexed directly, or by a handler called with the address.
+        self.readbuffers = [None] * 0x100
+        self.writebuffers = [None] * 0x100
+        self.readhandlers = [None] * 0x100
+        self.writehandlers = [None] * 0x100
+
+        # Per-register side effects on the I/O page. A register whose reader
+        # derives its value from the clock also reports when that value next
+        # changes, so idle loops polling it can be fast-forwarded.
+        self.ioreaders = [None] * 0x100
+        self.iowriters = [None] * 0x100
+        self.iochanges = [None] * 0x100
+
+        # Pages whose writes are reported to callbacks, such as caches of the code in them.
+        self.watchers = {} # page : (view, [callback, ...])
+
+        self.mapbuffer(0x00, 0x100, self.memory)
+        self.mapbuffer(0xE0, 0xFE, self.wram[:0x1E00]) # Echo RAM
+        self.maphandler(0xFF, 0x100, self.readio, self.writeio)
+
+        self.cartridge = None
+        self.mbc = None
+        if cartridge is not None:
+            self.loadcartridge(cartridge)
+
+    def mapbuffer(self, start, end, buffer, writable = True):
+        "Maps pages start to end (exclusive) onto consecutive 256-byte slices of buffer."
+        for i, page in enumerate(range(start, end)):
+            view = buffer[i << 8:(i + 1) << 8]
+            self.readbuffers[page] = view
+            self.writebuffers[page] = view if writable else None
+            self.readhandlers[page] = None
+            if writable:
+                self.writehandlers[page] = None
+
+    def maphandler(self, start, end, read = None, write = None):
+        "Routes accesses to pages start to end (exclusive) through handlers. None leaves that direction unchanged."
+        for page in range(start, end):
+            if read is not None:
+                self.readbuffers[page] = None
+                self.readhandlers[page] = read
+            if write is not None:
+                self.writebuffers[page] = None
+                self.writehandlers[page] = write
+
+    def mapio(self, addr, read = None, write = None, changes = None):
+        """Attaches side effects to the I/O register at addr. Unhandled registers read and write plain RAM.
+        changes(cycle) returns the first clock cycle after cycle at which the value read may change by itself."""
+        if read is not None:
+            self.ioreaders[addr & 0xFF] = read
+        if write is not None:
+            self.iowriters[addr & 0xFF] = write
+        if changes is not None:
+            self.iochanges[addr & 0xFF] = changes
+
+    def watch(self, page, callback):
+        """Calls callback(addr) after every write to a buffer mapped page, and to its echo RAM mirror, with the
+        address as seen through each. Writes to other pages take the usual path and cost nothing extra.
+        Remapping the page drops the watch, so callers check that writebuffers[page] is still None."""
+        for p in (page, mirror(page)):
+            if p is None:
+                continue
+            if self.writehandlers[p] != self.writewatched or self.writebuffers[p] is not None:
+                view = self.writebuffers[p]
+                if view is None:
+                    continue # ROM or handler mapped, it only changes by being remapped
+                self.watchers[p] = (view, [])
+                self.writebuffers[p] = None
+                self.writehandlers[p] = self.writewatched
+            callbacks = self.watchers[p][1]
+            if callback not in callbacks:
+                callbacks.append(callback)
+
+    def writewatched(self, addr, data):
+        page = addr >> 8
+        view, callbacks = self.watchers[page]
+        view[addr & 0xFF] = data & 0xFF
+        for callback in callbacks:
+            callback(addr)
+        alias = mirror(page)
+        if alias is not None and alias in self.watchers:
+            for callback in self.watchers[alias][1]:
+                callback(alias << 8 | addr & 0xFF)
+
+    def loadcartridge(self, cartridge):
+        "Maps the cartridge ROM and RAM through its memory bank controller."
+        self.cartridge = cartridge
+        self.mbc = cartridge.getmbc(self)
+
+    def readio(self, addr):
+        handler = self.ioreaders[addr & 0xFF]
+        if handler is None:
             return self.ram[addr]
+        return handler(addr)
+
+    def writeio(self, addr, data):
+        handler = self.iowriters[addr & 0xFF]
+        if handler is None:
+            self.ram[addr] = data & 0xFF
+        else:
+            handler(addr, data & 0xFF)
+
+    def write(self, addr, data):
+        "Writes to address through the page table."
+        buffer = self.writebuffers[addr >> 8]
+        if buffer is not None:
+            buffer[addr & 0xFF] = data & 0xFF
         else:
-            raise ValueError(f"Adress out of range.")
+            self.writehandlers[addr >> 8](addr, data)
+
+    def read(self, addr) -> int:
+        "Returns value at address through the page table."
+        buffer = self.readbuffers[addr >> 8]
+        if buffer is not None:
+            return buffer[addr & 0xFF]
+        return self.readhandlers[addr >> 8](addr)
+
+
+def mirror(page):
+    "Returns the page that aliases page through echo RAM, or None."
+    if 0xC0 <= page < 0xDE:
+        return page + 0x20
+    if 0xE0 <= page < 0xFE:
+        return page - 0x20
+    return None
+
 
-testbus = Bus()
+if __name__ == "__main__":
+    testcart = cart.Cartridge(open('ROMS/example.gb', "rb"))
 
-testcart = cart.Cartridge(open('ROMS/example.gb', "rb"))
+    testbus = Bus(testcart)
 
-testcpu = cpu.LR35902(testbus)
\ No newline at end of file
+    testcpu = cpu.LR35902(testbus)
@@ -1,3 +1,4 @@
+import mmap
 import sys
 import struct
 from array import array
@@ -66,11 +67,238 @@ Licensee_Codes = {
 	    0xA4 : "Konami (Yu-Gi-Oh!)"
 	}
 
+# Publisher names of the one-byte licensee code older cartridges use. 0x33 defers to the new code above.
+Old_Licensee_Codes = {
+	    0x00 : "None",
+	    0x01 : "Nintendo",
+	    0x08 : "Capcom",
+	    0x09 : "HOT-B",
+	    0x0A : "Jaleco",
+	    0x0B : "Coconuts Japan",
+	    0x0C : "Elite Systems",
+	    0x13 : "Electronic Arts",
+	    0x18 : "Hudson Soft",
+	    0x19 : "ITC Entertainment",
+	    0x1A : "Yanoman",
+	    0x1D : "Japan Clary",
+	    0x1F : "Virgin Games",
+	    0x24 : "PCM Complete",
+	    0x25 : "San-X",
+	    0x28 : "Kemco",
+	    0x29 : "SETA",
+	    0x30 : "Infogrames",
+	    0x31 : "Nintendo",
+	    0x32 : "Bandai",
+	    0x34 : "Konami",
+	    0x35 : "HectorSoft",
+	    0x38 : "Capcom",
+	    0x39 : "Banpresto",
+	    0x3C : "Entertainment Interactive",
+	    0x3E : "Gremlin",
+	    0x41 : "Ubi Soft",
+	    0x42 : "Atlus",
+	    0x44 : "Malibu Interactive",
+	    0x46 : "Angel",
+	    0x47 : "Spectrum HoloByte",
+	    0x49 : "Irem",
+	    0x4A : "Virgin Games",
+	    0x4D : "Malibu Interactive",
+	    0x4F : "U.S. Gold",
+	    0x50 : "Absolute",
+	    0x51 : "Acclaim",
+	    0x52 : "Activision",
+	    0x53 : "Sammy USA",
+	    0x54 : "GameTek",
+	    0x55 : "Park Place",
+	    0x56 : "LJN",
+	    0x57 : "Matchbox",
+	    0x59 : "Milton Bradley",
+	    0x5A : "Mindscape",
+	    0x5B : "Romstar",
+	    0x5C : "Naxat Soft",
+	    0x5D : "Tradewest",
+	    0x60 : "Titus",
+	    0x61 : "Virgin Games",
+	    0x67 : "Ocean",
+	    0x69 : "Electronic Arts",
+	    0x6E : "Elite Systems",
+	    0x6F : "Electro Brain",
+	    0x70 : "Infogrames",
+	    0x71 : "Interplay",
+	    0x72 : "Broderbund",
+	    0x73 : "Sculptured Software",
+	    0x75 : "The Sales Curve",
+	    0x78 : "THQ",
+	    0x79 : "Accolade",
+	    0x7A : "Triffix Entertainment",
+	    0x7C : "MicroProse",
+	    0x7F : "Kemco",
+	    0x80 : "Misawa Entertainment",
+	    0x83 : "LOZC",
+	    0x86 : "Tokuma Shoten",
+	    0x8B : "Bullet-Proof Software",
+	    0x8C : "Vic Tokai",
+	    0x8E : "Ape",
+	    0x8F : "I'Max",
+	    0x91 : "Chunsoft",
+	    0x92 : "Video System",
+	    0x93 : "Tsuburaya Productions",
+	    0x95 : "Varie",
+	    0x96 : "Yonezawa/S'Pal",
+	    0x97 : "Kemco",
+	    0x99 : "Arc",
+	    0x9A : "Nihon Bussan",
+	    0x9B : "Tecmo",
+	    0x9C : "Imagineer",
+	    0x9D : "Banpresto",
+	    0x9F : "Nova",
+	    0xA1 : "Hori Electric",
+	    0xA2 : "Bandai",
+	    0xA4 : "Konami",
+	    0xA6 : "Kawada",
+	    0xA7 : "Takara",
+	    0xA9 : "Technos Japan",
+	    0xAA : "Broderbund",
+	    0xAC : "Toei Animation",
+	    0xAD : "Toho",
+	    0xAF : "Namco",
+	    0xB0 : "Acclaim",
+	    0xB1 : "ASCII or Nexsoft",
+	    0xB2 : "Bandai",
+	    0xB4 : "Square Enix",
+	    0xB6 : "HAL Laboratory",
+	    0xB7 : "SNK",
+	    0xB9 : "Pony Canyon",
+	    0xBA : "Culture Brain",
+	    0xBB : "Sunsoft",
+	    0xBD : "Sony Imagesoft",
+	    0xBF : "Sammy",
+	    0xC0 : "Taito",
+	    0xC2 : "Kemco",
+	    0xC3 : "Square",
+	    0xC4 : "Tokuma Shoten",
+	    0xC5 : "Data East",
+	    0xC6 : "Tonkin House",
+	    0xC8 : "Koei",
+	    0xC9 : "UFL",
+	    0xCA : "Ultra Games",
+	    0xCB : "VAP",
+	    0xCC : "Use Corporation",
+	    0xCD : "Meldac",
+	    0xCE : "Pony Canyon",
+	    0xCF : "Angel",
+	    0xD0 : "Taito",
+	    0xD1 : "Sofel",
+	    0xD2 : "Quest",
+	    0xD3 : "Sigma Enterprises",
+	    0xD4 : "ASK Kodansha",
+	    0xD6 : "Naxat Soft",
+	    0xD7 : "Copya System",
+	    0xD9 : "Banpresto",
+	    0xDA : "Tomy",
+	    0xDB : "LJN",
+	    0xDD : "Nippon Computer Systems",
+	    0xDE : "Human",
+	    0xDF : "Altron",
+	    0xE0 : "Jaleco",
+	    0xE1 : "Towa Chiki",
+	    0xE2 : "Yutaka",
+	    0xE3 : "Varie",
+	    0xE5 : "Epoch",
+	    0xE7 : "Athena",
+	    0xE8 : "Asmik Ace",
+	    0xE9 : "Natsume",
+	    0xEA : "King Records",
+	    0xEB : "Atlus",
+	    0xEC : "Epic/Sony Records",
+	    0xEE : "IGS",
+	    0xF0 : "A Wave",
+	    0xF3 : "Extreme Entertainment",
+	    0xFF : "LJN"
+	}
+
+
+Cartridge_Types = {
+	    0x00 : "ROM ONLY",
+	    0x01 : "MBC1",
+	    0x02 : "MBC1+RAM",
+	    0x03 : "MBC1+RAM+BATTERY",
+	    0x05 : "MBC2",
+	    0x06 : "MBC2+BATTERY",
+	    0x08 : "ROM+RAM",
+	    0x09 : "ROM+RAM+BATTERY",
+	    0x0B : "MMM01",
+	    0x0C : "MMM01+RAM",
+	    0x0D : "MMM01+RAM+BATTERY",
+	    0x0F : "MBC3+TIMER+BATTERY",
+	    0x10 : "MBC3+TIMER+RAM+BATTERY",
+	    0x11 : "MBC3",
+	    0x12 : "MBC3+RAM",
+	    0x13 : "MBC3+RAM+BATTERY",
+	    0x19 : "MBC5",
+	    0x1A : "MBC5+RAM",
+	    0x1B : "MBC5+RAM+BATTERY",
+	    0x1C : "MBC5+RUMBLE",
+	    0x1D : "MBC5+RUMBLE+RAM",
+	    0x1E : "MBC5+RUMBLE+RAM+BATTERY",
+	    0x20 : "MBC6",
+	    0x22 : "MBC7+SENSOR+RUMBLE+RAM+BATTERY",
+	    0xFC : "POCKET CAMERA",
+	    0xFD : "BANDAI TAMA5",
+	    0xFE : "HuC3",
+	    0xFF : "HuC1+RAM+BATTERY"
+	}
+
+# Entry point, logo, title, CGB flag, new licensee code, SGB flag, cartridge type,
+# ROM size, RAM size, destination, old licensee code, version, header and global checksum.
+Header = struct.Struct(">4s48s15sB2sBBBBBBBBH")
+
+
+def decodeheader(data, offset = 0x0100):
+	"Decodes the cartridge header at offset in data. Needs only the first 0x150 bytes of the ROM."
+	(entry, logo, title, cgb, newlicensee, sgb, kind, romsize, ramsize,
+		destination, oldlicensee, version, headerchecksum, globalchecksum) = Header.unpack_from(data, offset)
+
+	if not cgb & 0x80:
+		title += bytes([cgb]) # Older cartridges use all 16 bytes for the title.
+
+	licensee = Old_Licensee_Codes.get(oldlicensee, "Unknown")
+	if oldlicensee == 0x33: # Use the new two-character code instead.
+		try:
+			licensee = Licensee_Codes.get(int(newlicensee, 16), "Unknown")
+		except ValueError:
+			licensee = "Unknown"
+
+	checksum = 0
+	for i in range(offset + 0x34, offset + 0x4D):
+		checksum = (checksum - data[i] - 1) & 0xFF
+
+	return {
+		"title" : title.split(b"\0")[0].decode("ascii", "replace"),
+		"cgb" : bool(cgb & 0x80),
+		"cgbonly" : cgb == 0xC0,
+		"sgb" : sgb == 0x03,
+		"type" : kind,
+		"typename" : Cartridge_Types.get(kind, "Unknown"),
+		"romsize" : 0x8000 << romsize,
+		"ramsize" : RAM_Sizes.get(ramsize, 0),
+		"licensee" : licensee,
+		"japanese" : destination == 0x00,
+		"version" : version,
+		"headerchecksum" : headerchecksum,
+		"headervalid" : checksum == headerchecksum,
+		"globalchecksum" : globalchecksum
+	}
+
 
 class Cartridge():
 
-	def __init__(self, ROM):
-		self.data = array("B", ROM.read())
+	def __init__(self, ROM, mapped = False):
+		"Loads the ROM from an open file. With mapped the file is memory-mapped read-only instead of copied, so instances of the same ROM share the page cache."
+		if mapped:
+			self.data = memoryview(mmap.mmap(ROM.fileno(), 0, access = mmap.ACCESS_READ))
+		else:
+			self.data = array("B", ROM.read())
 		self.size = len(self.data) #bytes
 		self.header = 0x0100
 	
@@ -83,7 +311,226 @@ class Cartridge():
 			datahex.append(format(self.data[i], 'X'))
 		print(datahex)
 
-	def getmetadata(self): #To be implemented
+	def getmetadata(self):
 		"Returns the metadata of the ROM."
+		metadata = decodeheader(self.data, self.header)
+		checksum = (sum(self.data) - self.data[0x14E] - self.data[0x14F]) & 0xFFFF
+		metadata["globalvalid"] = checksum == metadata["globalchecksum"]
+		return metadata
+
+	def getmbc(self, bus):
+		"Returns the memory bank controller for the cartridge type, mapped onto bus."
+		kind = self.data[0x147]
+		if kind not in MBC_Types:
+			raise ValueError(f"Unsupported cartridge type: {hex(kind)}")
+		return MBC_Types[kind](self, bus)
+
+
+class MBC():
+	"""Cartridge without a memory bank controller, and the base for the controllers below.
+	ROM and RAM banks are switched by pointing the bus page table at views of the bank,
+	so a switch never copies bank data."""
+
+	def __init__(self, cartridge, bus):
+		self.bus = bus
+		self.rom = memoryview(cartridge.data)
+		self.banks = max(2, len(cartridge.data) // 0x4000)
+		self.rompages = [None] * self.banks
+		size = RAM_Sizes.get(cartridge.data[0x149], 0)
+		self.ram = bytearray(max(size, 0x2000) if size else 0)
+		self.rampages = [self.pages(memoryview(self.ram), i, 0x20) for i in range(len(self.ram) // 0x2000)]
+		self.ramenabled = False
+		self.rombank = 1
+		self.rambank = 0
+
+		bus.maphandler(0x00, 0x80, write = self.write)
+		self.maprom(0, 0x00)
+		self.maprom(self.rombank, 0x40)
+		self.mapram()
+
+	def pages(self, buffer, bank, count):
+		"Returns the 256-byte page views of bank in buffer."
+		start = bank * count << 8
+		return [buffer[start + (i << 8):start + (i + 1 << 8)] for i in range(count)]
+
+	def maprom(self, bank, start):
+		"Points the 16 KiB ROM window at page start to bank."
+		bank %= self.banks
+		if self.rompages[bank] is None:
+			self.rompages[bank] = self.pages(self.rom, bank, 0x40)
+		self.bus.readbuffers[start:start + 0x40] = self.rompages[bank]
+
+	def mapram(self):
+		"Points the external RAM window at the selected bank, or disables it."
+		if self.ramenabled and self.rampages:
+			pages = self.rampages[self.rambank % len(self.rampages)]
+			self.bus.readbuffers[0xA0:0xC0] = pages
+			self.bus.writebuffers[0xA0:0xC0] = pages
+		else:
+			self.bus.maphandler(0xA0, 0xC0, self.readdisabled, self.writedisabled)
+
+	def readdisabled(self, addr):
+		return 0xFF
+
+	def writedisabled(self, addr, data):
 		pass
-		
\ No newline at end of file
+
+	def write(self, addr, data):
+		"Writes to ROM are ignored."
+		pass
+
+
+class ROMRAM(MBC):
+	"Cartridge without a memory bank controller but with RAM that is always enabled."
+
+	def __init__(self, cartridge, bus):
+		super().__init__(cartridge, bus)
+		self.ramenabled = True
+		self.mapram()
+
+
+class MBC1(MBC):
+
+	def __init__(self, cartridge, bus):
+		self.upper = 0 # Upper ROM bank bits or RAM bank
+		self.mode = 0
+		super().__init__(cartridge, bus)
+
+	def write(self, addr, data):
+		if addr < 0x2000:
+			self.ramenabled = data & 0x0F == 0x0A
+			self.mapram()
+		elif addr < 0x4000:
+			self.rombank = data & 0x1F or 1
+			self.maprom(self.upper << 5 | self.rombank, 0x40)
+		elif addr < 0x6000:
+			self.upper = data & 0x03
+			self.update()
+		else:
+			self.mode = data & 0x01
+			self.update()
+
+	def update(self):
+		self.maprom(self.upper << 5 if self.mode else 0, 0x00)
+		self.maprom(self.upper << 5 | self.rombank, 0x40)
+		self.rambank = self.upper if self.mode else 0
+		self.mapram()
+
+
+class MBC2(MBC):
+	"Controller with 512 half-bytes of built-in RAM, repeated across the external RAM window."
+
+	def __init__(self, cartridge, bus):
+		super().__init__(cartridge, bus)
+		self.ram = bytearray(0x200)
+		bus.maphandler(0xA0, 0xC0, self.readram, self.writeram)
+
+	def mapram(self):
+		pass
+
+	def readram(self, addr):
+		if self.ramenabled:
+			return 0xF0 | self.ram[addr & 0x1FF]
+		return 0xFF
+
+	def writeram(self, addr, data):
+		if self.ramenabled:
+			self.ram[addr & 0x1FF] = data & 0x0F
+
+	def write(self, addr, data):
+		if addr >= 0x4000:
+			return
+		if addr & 0x100:
+			self.rombank = data & 0x0F or 1
+			self.maprom(self.rombank, 0x40)
+		else:
+			self.ramenabled = data & 0x0F == 0x0A
+
+
+class MBC3(MBC):
+	"Controller with up to 128 ROM banks and real time clock registers. The clock registers hold their values but do not count."
+
+	def __init__(self, cartridge, bus):
+		self.rtc = bytearray(5)
+		self.latched = bytearray(5)
+		self.latch = 0xFF
+		super().__init__(cartridge, bus)
+
+	def mapram(self):
+		if self.ramenabled and self.rambank >= 0x08:
+			self.bus.maphandler(0xA0, 0xC0, self.readrtc, self.writertc)
+		else:
+			super().mapram()
+
+	def readrtc(self, addr):
+		return self.latched[self.rambank - 0x08]
+
+	def writertc(self, addr, data):
+		self.rtc[self.rambank - 0x08] = data
+		self.latched[self.rambank - 0x08] = data
+
+	def write(self, addr, data):
+		if addr < 0x2000:
+			self.ramenabled = data & 0x0F == 0x0A
+			self.mapram()
+		elif addr < 0x4000:
+			self.rombank = data & 0x7F or 1
+			self.maprom(self.rombank, 0x40)
+		elif addr < 0x6000:
+			if data <= 0x03 or 0x08 <= data <= 0x0C:
+				self.rambank = data
+				self.mapram()
+		else:
+			if self.latch == 0x00 and data == 0x01:
+				self.latched[:] = self.rtc
+			self.latch = data
+
+
+class MBC5(MBC):
+	"Controller with up to 512 ROM banks. Unlike the other controllers bank 0 can be mapped at 0x4000."
+
+	def write(self, addr, data):
+		if addr < 0x2000:
+			self.ramenabled = data & 0x0F == 0x0A
+			self.mapram()
+		elif addr < 0x3000:
+			self.rombank = self.rombank & 0x100 | data
+			self.maprom(self.rombank, 0x40)
+		elif addr < 0x4000:
+			self.rombank = (data & 0x01) << 8 | self.rombank & 0xFF
+			self.maprom(self.rombank, 0x40)
+		elif addr < 0x6000:
+			self.rambank = data & 0x0F
+			self.mapram()
+
+
+RAM_Sizes = {
+	    0x00 : 0,
+	    0x01 : 0x800,
+	    0x02 : 0x2000,
+	    0x03 : 0x8000,
+	    0x04 : 0x20000,
+	    0x05 : 0x10000
+	}
+
+MBC_Types = {
+	    0x00 : MBC,
+	    0x01 : MBC1,
+	    0x02 : MBC1,
+	    0x03 : MBC1,
+	    0x05 : MBC2,
+	    0x06 : MBC2,
+	    0x08 : ROMRAM,
+	    0x09 : ROMRAM,
+	    0x0F : MBC3,
+	    0x10 : MBC3,
+	    0x11 : MBC3,
+	    0x12 : MBC3,
+	    0x13 : MBC3,
+	    0x19 : MBC5,
+	    0x1A : MBC5,
+	    0x1B : MBC5,
+	    0x1C : MBC5,
+	    0x1D : MBC5,
+	    0x1E : MBC5
+	}
@@ -0,0 +1,108 @@
+"""Pre-decoded instruction cache for the LR35902.
+
+Each instruction is decoded once into a record of its handler, immediate operand,
+length and clock cycles, so running it again skips the opcode and operand reads
+and the table lookups. Records are kept per 256-byte page view and indexed by the
+low byte of the address, which makes the page view and address the key: the MBCs
+keep one view per bank page, so a bank switch selects another set of records."""
+
+from cpu import DECODEDHANDLERS, DECODEDPREFIXEDHANDLERS, LENGTHS
+
+
+class DecodeCache():
+    """Runs a CPU from pre-decoded instruction records instead of the per-opcode handlers.
+    Writable pages that hold records are watched on the bus, and a write drops the records
+    of the instructions it lands in."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.bus = cpu.bus
+        self.handlers = [(handler.__get__(cpu), cycles) for handler, cycles in DECODEDHANDLERS]
+        self.prefixedhandlers = [(handler.__get__(cpu), cycles) for handler, cycles in DECODEDPREFIXEDHANDLERS]
+        self.pages = {} # id(page view) : (page view, [record or None] * 0x100)
+        self.decoded = 0
+        self.invalidations = 0
+
+    def stats(self):
+        "Returns the number of instructions decoded and records invalidated."
+        return {"decoded" : self.decoded, "invalidations" : self.invalidations}
+
+    def records(self, page):
+        "Returns the record list of the page view mapped at page, creating it if needed."
+        view = self.bus.readbuffers[page]
+        entry = self.pages.get(id(view))
+        if entry is None:
+            entry = self.pages[id(view)] = (view, [None] * 0x100)
+        elif self.bus.writebuffers[page] is not None:
+            # The page was remapped since it was decoded, so writes may have been missed.
+            entry[1][:] = [None] * 0x100
+        if self.bus.writebuffers[page] is not None:
+            self.bus.watch(page, self.written)
+        return entry[1]
+
+    def decode(self, PC, records):
+        "Decodes the instruction at PC into records and returns its record, or None if it crosses into the next page."
+        view = self.bus.readbuffers[PC >> 8]
+        offset = PC & 0xFF
+        op = view[offset]
+        length = LENGTHS[op]
+        if offset + length > 0x100:
+            return None
+        if op == 0xCB:
+            handler, cycles = self.prefixedhandlers[view[offset + 1]]
+            operand = None
+        else:
+            handler, cycles = self.handlers[op]
+            operand = view[offset + 1] if length == 2 else view[offset + 1] | view[offset + 2] << 8 if length == 3 else None
+        record = records[offset] = (handler, operand, length, cycles)
+        self.decoded += 1
+        return record
+
+    def written(self, addr):
+        "Drops the records of the instructions covering addr after a write to a watched page."
+        entry = self.pages.get(id(self.bus.readbuffers[addr >> 8]))
+        if entry is None:
+            return
+        records = entry[1]
+        offset = addr & 0xFF
+        for start in range(max(offset - 2, 0), offset + 1):
+            if records[start] is not None and start + records[start][2] > offset:
+                records[start] = None
+                self.invalidations += 1
+
+    def run_cycles(self, n):
+        "Executes instructions from the decode cache until at least n clock cycles have passed and returns the cycles executed."
+        cpu = self.cpu
+        start = cpu.cycles
+        target = start + n
+        readbuffers = self.bus.readbuffers
+        writebuffers = self.bus.writebuffers
+        scheduler = cpu.scheduler
+        lastpage = False # Never a page view, so the first instruction looks its page up
+        records = None
+        while cpu.cycles < target:
+            if cpu.halted:
+                cpu.skiphalt(target)
+                continue
+            PC = cpu.PC
+            page = readbuffers[PC >> 8]
+            if page is not lastpage or writebuffers[PC >> 8] is not None:
+                if page is None:
+                    cpu.step() # Code on a handler mapped page, such as HRAM, is interpreted.
+                    continue
+                records = self.records(PC >> 8)
+                lastpage = page
+            record = records[PC & 0xFF]
+            if record is None:
+                record = self.decode(PC, records)
+                if record is None:
+                    cpu.step()
+                    continue
+            handler, operand, length, cycles = record
+            cpu.PC = PC + length & 0xFFFF
+            cpu.cycle = cycles
+            handler(operand)
+            cpu.cycles += cpu.cycle
+            if cpu.cycles >= scheduler.next:
+                scheduler.run(cpu.cycles)
+        return cpu.cycles - start
@@ -0,0 +1,231 @@
+"""LCD timing registers.
+
+Nothing is stepped per scanline. While the LCD is on, the position in the frame
+follows from the clock cycles since it was switched on, and LY, the STAT mode
+bits and the LY=LYC flag are derived from it when read. Events are only
+scheduled for the VBlank interrupt and for the STAT interrupt sources that are
+enabled, each at the cycle it is next raised, and, with a renderer attached,
+for the end of mode 3 on each visible line of the frames the rendering policy
+draws, where the line is drawn. The timing is the same whatever the policy."""
+
+
+LINE = 456 # Clock cycles per scanline
+LINES = 154 # Scanlines per frame, the last 10 in VBlank
+FRAME = LINE * LINES
+VISIBLE = 144 # Scanlines drawn before VBlank
+OAMSCAN = 80 # Clock cycles of mode 2 at the start of a visible line
+TRANSFER = 172 # Clock cycles of mode 3 that follow, the rest of the line is HBlank
+
+LCDC, STAT, LY, LYC = 0xFF40, 0xFF41, 0xFF44, 0xFF45
+
+# Rendering policies: draw every frame, every Nth frame, only the frame returned by get_frame, or nothing.
+POLICIES = ("always", "every", "request", "never")
+
+
+def mode(position):
+    "Returns the STAT mode at position clock cycles into the frame."
+    line, dot = divmod(position, LINE)
+    if line >= VISIBLE:
+        return 1
+    if dot < OAMSCAN:
+        return 2
+    if dot < OAMSCAN + TRANSFER:
+        return 3
+    return 0
+
+
+def nextboundary(position):
+    "Returns the first position after position at which the mode or LY changes. FRAME stands for the start of the next frame."
+    line, dot = divmod(position, LINE)
+    if line < VISIBLE:
+        for edge in (OAMSCAN, OAMSCAN + TRANSFER):
+            if dot < edge:
+                return line * LINE + edge
+    return (line + 1) * LINE
+
+
+class PPU():
+    """Maps LCDC, STAT, LY and LYC onto the I/O page of the CPU's bus.
+    The mode lengths are fixed, as on a line without sprites or scrolling, and
+    the STAT interrupt is raised on the rising edge of its combined sources."""
+
+    def __init__(self, cpu, renderer = None, policy = None, every = 1):
+        self.cpu = cpu
+        self.bus = cpu.bus
+        self.renderer = renderer # Object whose renderline(ly) draws a line, such as renderer.Renderer
+        self.policy = None
+        self.every = 1
+        self.base = 0 # Clock cycle at which the LCD was last switched on
+        self.frames = 0 # VBlanks since power on
+        self.vblankevent = None
+        self.statevent = None
+        self.lineevent = None
+        self.bus.mapio(LCDC, write = self.writelcdc)
+        self.bus.mapio(STAT, self.readstat, self.writestat, self.statchanges)
+        self.bus.mapio(LY, self.readly, self.writely, self.lychanges)
+        self.bus.mapio(LYC, write = self.writelyc)
+        self.setpolicy(policy or ("never" if renderer is None else "always"), every)
+
+    def enabled(self):
+        return self.bus.ram[LCDC] & 0x80
+
+    def position(self, cycle):
+        "Returns the clock cycles into the frame at cycle."
+        return (cycle - self.base) % FRAME
+
+    def statline(self, position):
+        "Returns whether any enabled STAT interrupt source holds at position."
+        stat = self.bus.ram[STAT]
+        current = mode(position)
+        return bool(stat & 0x08 and current == 0 or stat & 0x10 and current == 1 or stat & 0x20 and current == 2
+                    or stat & 0x40 and position // LINE == self.bus.ram[LYC])
+
+    def setpolicy(self, policy, every = 1):
+        "Selects which frames the renderer draws, one of POLICIES. every is the interval of the every policy. Without a renderer only never is allowed."
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid rendering policy: {policy}")
+        if every < 1:
+            raise ValueError(f"Invalid frame interval: {every}")
+        if self.renderer is None and policy != "never":
+            raise ValueError(f"Rendering policy {policy} needs a renderer")
+        self.policy = policy
+        self.every = every
+        if self.lineevent is not None:
+            self.cpu.scheduler.cancel(self.lineevent)
+            self.lineevent = None
+        if self.enabled():
+            self.scheduleline(self.cpu.cycles)
+
+    def drawing(self):
+        "Returns whether the lines of the current frame are drawn as they pass."
+        if self.policy == "always":
+            return True
+        if self.policy == "every":
+            return self.frames % self.every == 0
+        return False
+
+    def get_frame(self):
+        """Returns the framebuffer of the renderer, or None without one. Under the request policy the whole frame is
+        drawn first, from the current registers and VRAM, so changes made between lines in the frame are not seen."""
+        if self.renderer is None:
+            return None
+        if self.policy == "request":
+            for ly in range(VISIBLE):
+                self.renderer.renderline(ly)
+        return self.renderer.framebuffer
+
+    def reschedule(self):
+        "Schedules the next VBlank and STAT interrupts and line to draw, replacing the pending ones."
+        scheduler = self.cpu.scheduler
+        for event in (self.vblankevent, self.statevent, self.lineevent):
+            if event is not None:
+                scheduler.cancel(event)
+        self.vblankevent = self.statevent = self.lineevent = None
+        if not self.enabled():
+            return
+        now = self.cpu.cycles
+        self.schedulevblank(now)
+        self.schedulestat(now)
+        self.scheduleline(now)
+
+    def reschedulestat(self):
+        "Schedules the next STAT interrupt, replacing the pending one."
+        if self.statevent is not None:
+            self.cpu.scheduler.cancel(self.statevent)
+            self.statevent = None
+        if self.enabled():
+            self.schedulestat(self.cpu.cycles)
+
+    def schedulevblank(self, cycle):
+        position = self.position(cycle)
+        start = VISIBLE * LINE if position < VISIBLE * LINE else FRAME + VISIBLE * LINE
+        self.vblankevent = self.cpu.scheduler.schedule(cycle - position + start, self.vblank)
+
+    def schedulestat(self, cycle):
+        "Schedules the STAT interrupt at the next rising edge of its sources after cycle, if there is one within a frame."
+        if not self.bus.ram[STAT] & 0x78:
+            return
+        held = self.statline(self.position(cycle))
+        for i in range(VISIBLE * 3 + LINES - VISIBLE + 1):
+            position = self.position(cycle)
+            cycle += nextboundary(position) - position
+            raised = self.statline(self.position(cycle))
+            if raised and not held:
+                self.statevent = self.cpu.scheduler.schedule(cycle, self.statinterrupt)
+                return
+            held = raised
+
+    def scheduleline(self, cycle):
+        "Schedules drawing the next line of the frame whose mode 3 ends after cycle, if the frame is drawn. VBlank starts the next frame."
+        if self.renderer is None or not self.drawing():
+            return
+        position = self.position(cycle)
+        line, dot = divmod(position, LINE)
+        if dot >= OAMSCAN + TRANSFER:
+            line += 1
+        if line >= VISIBLE:
+            return
+        self.lineevent = self.cpu.scheduler.schedule(cycle - position + line * LINE + OAMSCAN + TRANSFER, self.drawline)
+
+    def drawline(self, cycle):
+        self.lineevent = None
+        self.renderer.renderline(self.position(cycle) // LINE)
+        self.scheduleline(cycle)
+
+    def vblank(self, cycle):
+        self.vblankevent = None
+        self.frames += 1
+        self.cpu.requestinterrupt(0)
+        self.schedulevblank(cycle)
+        self.scheduleline(cycle + (LINES - VISIBLE) * LINE)
+
+    def statinterrupt(self, cycle):
+        self.statevent = None
+        self.cpu.requestinterrupt(1)
+        self.schedulestat(cycle)
+
+    def writelcdc(self, addr, data):
+        "Stores LCDC. Switching the LCD on restarts the frame at line 0."
+        old = self.bus.ram[addr]
+        self.bus.ram[addr] = data
+        if (old ^ data) & 0x80:
+            if data & 0x80:
+                self.base = self.cpu.cycles
+            self.reschedule()
+
+    def readstat(self, addr):
+        "Returns STAT with the mode and LY=LYC bits of the current position. Bit 7 reads as set."
+        stat = self.bus.ram[addr] | 0x80
+        if not self.enabled():
+            return stat
+        position = self.position(self.cpu.cycles)
+        return stat | (position // LINE == self.bus.ram[LYC]) << 2 | mode(position)
+
+    def writestat(self, addr, data):
+        "Stores the interrupt source bits of STAT. The others are read only."
+        self.bus.ram[addr] = data & 0x78
+        self.reschedulestat()
+
+    def statchanges(self, cycle):
+        if not self.enabled():
+            return float("inf")
+        position = self.position(cycle)
+        return cycle - position + nextboundary(position)
+
+    def readly(self, addr):
+        if not self.enabled():
+            return 0
+        return self.position(self.cpu.cycles) // LINE
+
+    def writely(self, addr, data):
+        "LY is read only."
+        pass
+
+    def lychanges(self, cycle):
+        if not self.enabled():
+            return float("inf")
+        return cycle - self.position(cycle) % LINE + LINE
+
+    def writelyc(self, addr, data):
+        self.bus.ram[addr] = data
+        self.reschedulestat()
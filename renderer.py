@@ -0,0 +1,120 @@
+"""Scanline renderer for the background, window and sprites.
+
+Each call composes one whole 160 pixel line with NumPy. The rows of all the
+tiles a line crosses are gathered at once from the decoded tiles of a
+TileCache, so there is no Python loop over pixels, only over the at most 10
+sprites on the line. The tile map and OAM are read through NumPy views of the
+bus's VRAM and OAM memoryviews, and the registers straight from its bytearray."""
+
+import numpy as np
+
+from tilecache import TileCache, XFLIP
+
+
+WIDTH = 160
+HEIGHT = 144
+
+LCDC, SCY, SCX, BGP, OBP0, OBP1, WY, WX = 0xFF40, 0xFF42, 0xFF43, 0xFF47, 0xFF48, 0xFF49, 0xFF4A, 0xFF4B
+
+# Tile number of a tile map index, for each addressing mode selected by LCDC bit 4.
+INDICES = np.arange(0x100)
+TILENUMBERS = (np.where(INDICES < 0x80, 0x100 + INDICES, INDICES), INDICES)
+
+COLUMNS = np.arange(WIDTH)
+SPRITECOLUMNS = np.arange(8)
+
+
+def palette(value):
+    "Returns the four shades of a palette register as an array indexed by colour number."
+    return np.array([value >> shift & 0x3 for shift in (0, 2, 4, 6)], dtype = np.uint8)
+
+
+class Renderer():
+    """Renders scanlines into framebuffer, an array of shades 0 (white) to 3 (black) with one row per line.
+    Given an output such as a sharedframe.SharedFramebuffer, each frame is drawn into the buffer that
+    output.acquire returns, and output.publish is called once its last line is drawn."""
+
+    def __init__(self, bus, output = None):
+        self.ram = bus.ram
+        self.vram = np.frombuffer(bus.vram, dtype = np.uint8)
+        self.oam = np.frombuffer(bus.oam, dtype = np.uint8).reshape(40, 4)
+        self.tilecache = TileCache(bus)
+        self.output = output
+        self.framebuffer = np.zeros((HEIGHT, WIDTH), dtype = np.uint8) if output is None else output.acquire()
+        self.colours = np.zeros(WIDTH, dtype = np.uint8) # Background colour numbers of the line, for sprite priority
+        # Per pixel of the line, whether a sprite covers it and that sprite's shade and BG priority bit.
+        self.occupied = np.zeros(WIDTH, dtype = bool)
+        self.spriteshades = np.zeros(WIDTH, dtype = np.uint8)
+        self.behind = np.zeros(WIDTH, dtype = bool)
+        self.windowline = 0 # Window rows drawn so far this frame
+
+    def tilerow(self, mapbase, row, fine, signed):
+        "Returns the colour numbers of the 256 pixel row fine of tile row row in the tile map at mapbase."
+        numbers = TILENUMBERS[not signed][self.vram[mapbase + row * 32:mapbase + row * 32 + 32]]
+        return self.tilecache.lookup(numbers)[numbers, fine].reshape(0x100)
+
+    def renderline(self, ly):
+        "Composes line ly into the framebuffer from the current registers, VRAM and OAM."
+        ram = self.ram
+        lcdc = ram[LCDC]
+        if self.output is not None:
+            self.framebuffer = self.output.acquire()
+        line = self.framebuffer[ly]
+        colours = self.colours
+        if ly == 0:
+            self.windowline = 0
+
+        if lcdc & 0x01:
+            signed = not lcdc & 0x10
+            y = ly + ram[SCY] & 0xFF
+            pixels = self.tilerow(0x1C00 if lcdc & 0x08 else 0x1800, y >> 3, y & 0x7, signed)
+            colours[:] = pixels[COLUMNS + ram[SCX] & 0xFF]
+            wx = ram[WX] - 7
+            if lcdc & 0x20 and ly >= ram[WY] and wx < WIDTH:
+                wy = self.windowline
+                pixels = self.tilerow(0x1C00 if lcdc & 0x40 else 0x1800, wy >> 3, wy & 0x7, signed)
+                start = max(wx, 0)
+                colours[start:] = pixels[start - wx:WIDTH - wx]
+                self.windowline += 1
+            line[:] = palette(ram[BGP])[colours]
+        else:
+            colours[:] = 0
+            line[:] = 0
+
+        if lcdc & 0x02:
+            self.rendersprites(ly, line, 16 if lcdc & 0x04 else 8)
+
+        if self.output is not None and ly == HEIGHT - 1:
+            self.output.publish()
+
+    def rendersprites(self, ly, line, height):
+        """Draws the sprites on line ly over line. Of overlapping opaque pixels the one of the sprite with the lower X,
+        then the earlier in OAM, wins, and only the winner's BG priority bit decides whether the background shows instead."""
+        oam = self.oam
+        top = oam[:, 0].astype(np.int16) - 16
+        found = np.nonzero((top <= ly) & (ly < top + height))[0][:10]
+        if not len(found):
+            return
+        palettes = (palette(self.ram[OBP0]), palette(self.ram[OBP1]))
+        occupied, shades, behind = self.occupied, self.spriteshades, self.behind
+        occupied[:] = False
+        # Resolve the sprites against each other first, highest priority first, so a pixel is only taken once.
+        for i in sorted(found, key = lambda i: (oam[i, 1], i)):
+            y, x, tile, attr = (int(value) for value in oam[i])
+            row = ly - (y - 16)
+            if attr & 0x40:
+                row = height - 1 - row # A flipped 8x16 sprite also swaps its two tiles, so pick the row in the unflipped tile.
+            if height == 16:
+                tile = (tile & 0xFE) + (row >> 3)
+            flip = XFLIP if attr & 0x20 else 0
+            pixels = self.tilecache.lookup(np.array([tile]), flip)[tile, row & 0x7]
+            xs = x - 8 + SPRITECOLUMNS
+            visible = (xs >= 0) & (xs < WIDTH) & (pixels != 0)
+            xs = xs[visible]
+            free = ~occupied[xs]
+            xs = xs[free]
+            occupied[xs] = True
+            shades[xs] = palettes[attr >> 4 & 0x1][pixels[visible][free]]
+            behind[xs] = bool(attr & 0x80)
+        shown = occupied & ~(behind & (self.colours != 0))
+        line[shown] = shades[shown]
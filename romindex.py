@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+import cart
+
+
+CHUNK = 0x100000
+
+
+def scanrom(path):
+    "Returns the SHA-1 hash and header metadata of the ROM at path, streaming the file instead of loading it."
+    sha1 = hashlib.sha1()
+    checksum = 0
+    with open(path, "rb") as rom:
+        header = rom.read(0x150)
+        if len(header) < 0x150:
+            raise ValueError(f"File too small to be a ROM: {path}")
+        metadata = cart.decodeheader(header)
+        sha1.update(header)
+        checksum += sum(header) - header[0x14E] - header[0x14F]
+        while chunk := rom.read(CHUNK):
+            sha1.update(chunk)
+            checksum += sum(chunk)
+    metadata["globalvalid"] = checksum & 0xFFFF == metadata["globalchecksum"]
+    return sha1.hexdigest(), metadata
+
+
+def indexroms(directory, database = "roms.db", extensions = (".gb", ".gbc")):
+    """Scans directory for ROMs and records their metadata in an SQLite index with one row per file, looked up
+    by hash, dropping entries whose file no longer exists. Returns the number of hashes new to the index."""
+    db = sqlite3.connect(database)
+    columns = [name for cid, name, kind, notnull, default, pk in db.execute("PRAGMA table_info(roms)") if pk]
+    if columns == ["hash"]:
+        db.execute("DROP TABLE roms") # Indexes from before rows were keyed by path are rebuilt by this scan.
+    db.execute("CREATE TABLE IF NOT EXISTS roms (path TEXT PRIMARY KEY, hash TEXT, size INTEGER, mtime REAL, metadata TEXT)")
+    db.execute("DROP INDEX IF EXISTS roms_path")
+    db.execute("CREATE INDEX IF NOT EXISTS roms_hash ON roms (hash)")
+    known = {path : (size, mtime) for path, size, mtime in db.execute("SELECT path, size, mtime FROM roms")}
+
+    added = 0
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if not name.lower().endswith(extensions):
+                continue
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            if known.get(path) == (stat.st_size, stat.st_mtime):
+                continue # Unchanged since the last scan, skip hashing it.
+            try:
+                digest, metadata = scanrom(path)
+            except (OSError, ValueError) as error:
+                print(f"Skipping {path}: {error}", file = sys.stderr)
+                continue
+            if db.execute("SELECT 1 FROM roms WHERE hash = ?", (digest,)).fetchone() is None:
+                added += 1
+            db.execute("INSERT OR REPLACE INTO roms VALUES (?, ?, ?, ?, ?)",
+                       (path, digest, stat.st_size, stat.st_mtime, json.dumps(metadata)))
+
+    # Drop the entries of files that have been deleted or moved since they were indexed.
+    for path in known:
+        if not os.path.exists(path):
+            db.execute("DELETE FROM roms WHERE path = ?", (path,))
+    db.commit()
+    db.close()
+    return added
+
+
+def lookup(digest, database = "roms.db"):
+    "Returns the metadata recorded for a ROM hash, or None."
+    db = sqlite3.connect(database)
+    row = db.execute("SELECT metadata FROM roms WHERE hash = ?", (digest,)).fetchone()
+    db.close()
+    return None if row is None else json.loads(row[0])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <rom directory> [database]")
+        sys.exit(1)
+    added = indexroms(*sys.argv[1:3])
+    print(f"Indexed {added} ROMs.")
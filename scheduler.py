@@ -0,0 +1,32 @@
+import heapq
+
+
+class Scheduler():
+    "Min-heap of events keyed on the absolute clock cycle at which they are due."
+
+    def __init__(self):
+        self.events = []
+        self.order = 0 # Keeps events due on the same cycle in scheduling order
+        self.next = float("inf") # Cycle of the earliest pending event
+
+    def schedule(self, cycle, callback):
+        "Calls callback(cycle) once the clock reaches cycle. Returns a handle that can be passed to cancel."
+        event = [cycle, self.order, callback]
+        self.order += 1
+        heapq.heappush(self.events, event)
+        if cycle < self.next:
+            self.next = cycle
+        return event
+
+    def cancel(self, event):
+        "Cancels a scheduled event. The entry is dropped from the heap when it comes due."
+        event[2] = None
+
+    def run(self, now):
+        "Fires every event due at or before cycle now, in cycle order."
+        events = self.events
+        while events and events[0][0] <= now:
+            cycle, order, callback = heapq.heappop(events)
+            if callback is not None:
+                callback(cycle)
+        self.next = events[0][0] if events else float("inf")
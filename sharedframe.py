@@ -0,0 +1,95 @@
+"""Framebuffers in shared memory, for consumers in other processes.
+
+The block starts with a header of 64-bit counters followed by a ring of frame
+slots. The renderer draws into one slot while the others hold finished frames,
+so a reader can keep a NumPy view of the latest frame for a while without
+copying it. Each slot has a sequence number that is odd while the slot is being
+drawn. A reader notes it before using the view and checks it afterwards, as
+with a seqlock, and only retries if the writer came around to that slot again."""
+
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from renderer import WIDTH, HEIGHT
+
+
+SLOTS, LATEST, FRAMES = range(3) # Header fields, followed by the sequence number and frame number of each slot
+ALIGN = 64 # The header is padded to a multiple of this many bytes, so the frames start cache line aligned
+
+
+class SharedFramebuffer():
+    """Ring of frame slots in a named shared memory block. Created without a name it allocates a new block,
+    given the name of an existing one it attaches to it. The writer passes it to the Renderer, readers call
+    latest and valid. Relies on stores to the block becoming visible in program order, as they do on x86."""
+
+    def __init__(self, name = None, slots = 3):
+        if name is None:
+            if slots < 2:
+                raise ValueError(f"Need at least 2 slots, not {slots}")
+            size = headersize(slots) + slots * HEIGHT * WIDTH
+            self.memory = shared_memory.SharedMemory(create = True, size = size)
+            self.header = np.ndarray(headersize(slots) // 8, dtype = np.uint64, buffer = self.memory.buf)
+            self.header[SLOTS] = slots
+        else:
+            try:
+                self.memory = shared_memory.SharedMemory(name, track = False)
+            except TypeError:
+                # Before Python 3.13 attaching registers the block too, and it would be unlinked when this process exits.
+                self.memory = shared_memory.SharedMemory(name)
+                resource_tracker.unregister(self.memory._name, "shared_memory")
+            slots = int(np.ndarray(1, dtype = np.uint64, buffer = self.memory.buf)[0])
+            self.header = np.ndarray(headersize(slots) // 8, dtype = np.uint64, buffer = self.memory.buf)
+        self.name = self.memory.name
+        self.slots = slots
+        self.sequences = self.header[3:3 + slots]
+        self.numbers = self.header[3 + slots:3 + 2 * slots]
+        self.frames = np.ndarray((slots, HEIGHT, WIDTH), dtype = np.uint8, buffer = self.memory.buf, offset = headersize(slots))
+        self.slot = None # Slot being drawn
+
+    def acquire(self):
+        "Marks the slot after the latest frame as being drawn and returns its framebuffer."
+        if self.slot is None:
+            self.slot = (int(self.header[LATEST]) + 1) % self.slots if self.header[FRAMES] else 0
+            self.sequences[self.slot] += 1
+        return self.frames[self.slot]
+
+    def publish(self):
+        "Marks the slot being drawn as finished and makes it the latest frame."
+        slot = self.slot
+        self.numbers[slot] = self.header[FRAMES] + 1
+        self.sequences[slot] += 1
+        self.header[LATEST] = slot
+        self.header[FRAMES] += 1
+        self.slot = None
+
+    def latest(self):
+        """Returns (token, frame number, view) for the latest finished frame, or None before the first. The view
+        is not copied; once done with it, valid(token) tells whether the writer started drawing over it meanwhile."""
+        while self.header[FRAMES]:
+            slot = int(self.header[LATEST])
+            sequence = int(self.sequences[slot])
+            if sequence & 1:
+                continue # The writer has come around to the slot since reading LATEST.
+            number = int(self.numbers[slot])
+            if self.sequences[slot] == sequence:
+                return (slot, sequence), number, self.frames[slot]
+        return None
+
+    def valid(self, token):
+        "Returns whether the frame that latest returned token for has not been drawn over since."
+        slot, sequence = token
+        return self.sequences[slot] == sequence
+
+    def close(self):
+        "Detaches from the block. The creator should also call unlink once every process is done with it."
+        self.header = self.sequences = self.numbers = self.frames = None
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
+
+
+def headersize(slots):
+    "Returns the bytes of the header for slots slots, padded to ALIGN."
+    return -(-(3 + 2 * slots) * 8 // ALIGN) * ALIGN
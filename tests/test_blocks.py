@@ -0,0 +1,76 @@
+import unittest
+
+import bus
+import cpu
+import ppu
+import timer
+from blocks import BlockCompiler
+
+
+def poll(register, value):
+    "Returns a program that waits for register to read value, counts it in B and waits for it to change again."
+    return bytes([
+        0xF0, register,         # LDH A, (register)   <- 0x0150
+        0xFE, value,            # CP value
+        0x20, 0xFA,             # JR NZ, 0x0150
+        0x04,                   # INC B
+        0xF0, register,         # LDH A, (register)   <- 0x0157
+        0xFE, value,            # CP value
+        0x28, 0xFA,             # JR Z, 0x0157
+        0x18, 0xF1              # JR 0x0150
+    ])
+
+
+def machine(program, peripheral):
+    "Returns a CPU running program at 0x0150 with peripheral attached."
+    proc = cpu.LR35902(bus.Bus())
+    for i, byte in enumerate(program):
+        proc.bus.write(0x0150 + i, byte)
+    proc.PC = 0x0150
+    peripheral(proc)
+    return proc
+
+
+def lcd(proc):
+    ppu.PPU(proc)
+    proc.bus.write(ppu.LCDC, 0x91)
+
+
+def state(proc):
+    return (proc.A, proc.F, proc.B, proc.C, proc.D, proc.E, proc.H, proc.L, proc.SP, proc.PC, proc.cycles, bytes(proc.bus.ram))
+
+
+class IdleSkipTest(unittest.TestCase):
+    "Runs polling loops with idle skipping on and off and expects the same end state."
+
+    TOTAL = ppu.FRAME * 4
+    CHUNKINGS = ((TOTAL,), (ppu.FRAME,), (1000,), (17, 4000, 333, 70224))
+
+    def run_chunked(self, proc, skipidle, chunks):
+        compiler = BlockCompiler(proc, skipidle = skipidle)
+        i = 0
+        while proc.cycles < self.TOTAL:
+            compiler.run_cycles(min(chunks[i % len(chunks)], self.TOTAL - proc.cycles))
+            i += 1
+        return compiler.stats()
+
+    def check(self, program, peripheral):
+        for chunks in self.CHUNKINGS:
+            with self.subTest(chunks = chunks):
+                skipping = machine(program, peripheral)
+                stepping = machine(program, peripheral)
+                stats = self.run_chunked(skipping, True, chunks)
+                self.run_chunked(stepping, False, chunks)
+                self.assertEqual(state(skipping), state(stepping))
+                self.assertGreater(stats["skipped"], 0)
+                self.assertGreater(skipping.B, 0)
+
+    def test_ly_poll(self):
+        self.check(poll(0x44, 0x90), lcd)
+
+    def test_div_poll(self):
+        self.check(poll(0x04, 0x40), timer.Timer)
+
+
+if __name__ == "__main__":
+    unittest.main()
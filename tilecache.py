@@ -0,0 +1,77 @@
+"""Decoded tile cache for the renderer.
+
+The 384 tiles in VRAM are decoded from 2bpp into 8x8 arrays of colour numbers,
+held together in one (384, 8, 8) array, and kept until a bus write to the tile
+data marks them dirty. A dirty tile is decoded again the next time it is looked
+up. Flipped variants are separate arrays with their own dirty flags, created
+the first time they are asked for."""
+
+import numpy as np
+
+
+TILES = 384
+
+# Variants, as bit masks matching the flip bits of an OAM entry shifted down by 5.
+XFLIP = 1
+YFLIP = 2
+
+
+class TileCache():
+    """Watches the tile data pages on the bus, so it only sees writes that go through
+    bus.write. Code that writes bus.ram directly has to call invalidate."""
+
+    def __init__(self, bus):
+        self.data = np.frombuffer(bus.vram[:0x1800], dtype = np.uint8).reshape(TILES, 8, 2)
+        self.variants = {} # flip : (tiles, dirty flags as a bytearray, NumPy view of the flags)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        for page in range(0x80, 0x98):
+            bus.watch(page, self.written)
+
+    def stats(self):
+        "Returns the number of tile lookups served from the cache, tiles decoded and tiles marked dirty by writes."
+        return {"hits" : self.hits, "misses" : self.misses, "invalidations" : self.invalidations}
+
+    def written(self, addr):
+        "Marks the tile covering addr dirty in every variant after a write to the tile data."
+        tile = addr - 0x8000 >> 4
+        invalidated = False
+        for tiles, dirty, flags in self.variants.values():
+            if not dirty[tile]:
+                dirty[tile] = 1
+                invalidated = True
+        if invalidated:
+            self.invalidations += 1
+
+    def invalidate(self):
+        "Marks every tile dirty."
+        for tiles, dirty, flags in self.variants.values():
+            flags[:] = 1
+
+    def decode(self, numbers, flip):
+        "Returns the colour numbers of the tiles numbers as an (n, 8, 8) array, flipped as flip says."
+        rows = self.data[numbers]
+        tiles = np.unpackbits(rows[:, :, 1:], axis = -1) << 1 | np.unpackbits(rows[:, :, :1], axis = -1)
+        if flip & XFLIP:
+            tiles = tiles[:, :, ::-1]
+        if flip & YFLIP:
+            tiles = tiles[:, ::-1, :]
+        return tiles
+
+    def lookup(self, numbers, flip = 0):
+        "Decodes whichever of the tiles numbers are dirty and returns the (384, 8, 8) array of the variant flip to index them in."
+        variant = self.variants.get(flip)
+        if variant is None:
+            dirty = bytearray(b"\x01" * TILES)
+            variant = self.variants[flip] = (np.zeros((TILES, 8, 8), dtype = np.uint8), dirty, np.frombuffer(dirty, dtype = np.uint8))
+        tiles, dirty, flags = variant
+        stale = flags[numbers] != 0
+        count = int(stale.sum())
+        if count:
+            decoded = np.unique(numbers[stale])
+            tiles[decoded] = self.decode(decoded, flip)
+            flags[decoded] = 0
+            self.misses += len(decoded)
+        self.hits += len(numbers) - count
+        return tiles
@@ -0,0 +1,117 @@
+"""DIV and TIMA timer registers.
+
+Nothing is counted per instruction. DIV is the upper byte of a 16-bit counter
+that runs at the clock rate, so it is derived from the CPU's clock cycle count
+when read. TIMA is stored together with the cycle it was last brought up to
+date, and a read adds the increments since then. The only event scheduled is
+the next TIMA overflow, which reloads TMA and requests the timer interrupt."""
+
+
+# Clock cycles per TIMA increment, indexed by the low two bits of TAC.
+PERIODS = (1024, 16, 64, 256)
+
+DIV, TIMA, TMA, TAC = 0xFF04, 0xFF05, 0xFF06, 0xFF07
+
+
+class Timer():
+    """Maps DIV, TIMA, TMA and TAC onto the I/O page of the CPU's bus.
+    The extra increments caused by writing DIV or TAC while the selected
+    counter bit is set are not modelled."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.bus = cpu.bus
+        self.divbase = 0 # Clock cycle at which the internal counter was last zero
+        self.tima = 0 # TIMA as of timacycle
+        self.timacycle = 0
+        self.event = None # Scheduled TIMA overflow
+        self.bus.mapio(DIV, self.readdiv, self.writediv, self.divchanges)
+        self.bus.mapio(TIMA, self.readtima, self.writetima, self.timachanges)
+        self.bus.mapio(TMA, write = self.writetma)
+        self.bus.mapio(TAC, self.readtac, self.writetac, lambda cycle: float("inf"))
+
+    def period(self):
+        "Returns the clock cycles per TIMA increment, or None if the timer is stopped."
+        tac = self.bus.ram[TAC]
+        return PERIODS[tac & 0x3] if tac & 0x4 else None
+
+    def counter(self, cycle):
+        "Returns the internal counter at cycle, without wrapping it to 16 bits."
+        return cycle - self.divbase
+
+    def value(self, cycle):
+        "Returns TIMA at cycle, reloading TMA for overflows whose event has not fired yet."
+        period = self.period()
+        if period is None:
+            return self.tima
+        tima = self.tima + self.counter(cycle) // period - self.counter(self.timacycle) // period
+        if tima > 0xFF:
+            tma = self.bus.ram[TMA]
+            tima = tma + (tima - 0x100) % (0x100 - tma)
+        return tima
+
+    def sync(self, cycle):
+        "Brings the stored TIMA up to date at cycle."
+        self.tima = self.value(cycle)
+        self.timacycle = cycle
+
+    def reschedule(self):
+        "Schedules the event for the next TIMA overflow, replacing the pending one."
+        if self.event is not None:
+            self.cpu.scheduler.cancel(self.event)
+            self.event = None
+        period = self.period()
+        if period is None:
+            return
+        # The increments fall on the cycles where the counter reaches a multiple of the period.
+        first = (self.counter(self.timacycle) // period + 1) * period
+        due = self.divbase + first + (0xFF - self.tima) * period
+        self.event = self.cpu.scheduler.schedule(due, self.overflow)
+
+    def overflow(self, cycle):
+        "Reloads TIMA from TMA and requests the timer interrupt."
+        self.event = None
+        self.sync(cycle)
+        self.cpu.requestinterrupt(2)
+        self.reschedule()
+
+    def readdiv(self, addr):
+        return self.counter(self.cpu.cycles) >> 8 & 0xFF
+
+    def writediv(self, addr, data):
+        "Resets the internal counter, whatever is written."
+        now = self.cpu.cycles
+        self.sync(now)
+        self.divbase = now
+        self.reschedule()
+
+    def divchanges(self, cycle):
+        return self.divbase + (self.counter(cycle) // 256 + 1) * 256
+
+    def readtima(self, addr):
+        return self.value(self.cpu.cycles)
+
+    def writetima(self, addr, data):
+        self.tima = data
+        self.timacycle = self.cpu.cycles
+        self.reschedule()
+
+    def timachanges(self, cycle):
+        period = self.period()
+        if period is None:
+            return float("inf")
+        return self.divbase + (self.counter(cycle) // period + 1) * period
+
+    def writetma(self, addr, data):
+        "Stores TMA. TIMA is synced first, since an overflow not yet handled reloads the old value."
+        self.sync(self.cpu.cycles)
+        self.bus.ram[addr] = data
+
+    def readtac(self, addr):
+        "Returns TAC. The unused upper bits read as set."
+        return self.bus.ram[addr] | 0xF8
+
+    def writetac(self, addr, data):
+        self.sync(self.cpu.cycles)
+        self.bus.ram[addr] = data & 0x07
+        self.reschedule()